@@ -1,26 +1,67 @@
-import geopandas as gpd
-import pandas as pd
 import json
 import sys
 import os
+import shutil
+import pickle
+import concurrent.futures
+from itertools import repeat
 
-def process_election_data(csv_filename, geojson_filename='polling_divisions.geojson', output_prefix=None):
+# geopandas drags in pyproj/shapely/pyogrio (~2 s of import time), so the heavy
+# stack is loaded lazily: usage/help/missing-file runs never pay for it.
+gpd = None
+pd = None
+np = None
+_leading_candidate = None
+
+def _load_heavy_imports():
+    """Import the geo/numeric stack on first use and pick the fastest kernel"""
+    global gpd, pd, np, _leading_candidate
+    if gpd is not None:
+        return
+    import geopandas
+    import pandas
+    import numpy
+    import pyogrio  # noqa: F401 — fail fast if the fast I/O engine is missing
+    import pyarrow  # noqa: F401 — needed for CSV parsing and the parquet cache
+    gpd = geopandas
+    pd = pandas
+    np = numpy
+    try:
+        from numba import njit
+        _leading_candidate = njit(cache=True)(_leading_candidate_kernel)
+    except ImportError:
+        # numba is optional; the vectorized NumPy path is plenty for narrow ballots
+        _leading_candidate = _leading_candidate_numpy
+
+def process_election_data(csv_filename, geojson_filename='polling_divisions.geojson', output_prefix=None, simplify_tolerance=1e-5, write_full=True, verbose=False):
     """
     Process election data from CSV and merge with GeoJSON polling division boundaries
-    
+
     Parameters:
     csv_filename: Path to the election results CSV file
     geojson_filename: Path to the GeoJSON file with polling division boundaries
     output_prefix: Prefix for output files (defaults to CSV filename without extension)
+    simplify_tolerance: Douglas-Peucker tolerance (in degrees) for the simplified
+                        web output; set to 0 or None to keep full-resolution geometry
+    write_full: Also write the full-data GeoJSON; the web front-end only needs
+                the simplified file, and the full write doubles the output I/O
+    verbose: Print progress diagnostics; off by default so batch runs stay quiet
     """
-    
+
+    def vprint(*args):
+        if verbose:
+            print(*args)
+
+    _load_heavy_imports()
+
     # Set output prefix if not provided
     if output_prefix is None:
         output_prefix = os.path.splitext(os.path.basename(csv_filename))[0]
     
-    # Read CSV data
-    print(f"Reading CSV data from: {csv_filename}")
-    csv_data = pd.read_csv(csv_filename)
+    # Read CSV data (pyarrow parses in parallel; columns stay NumPy-backed so the
+    # dtype checks and category/int32 conversions below behave as before)
+    vprint(f"Reading CSV data from: {csv_filename}")
+    csv_data = pd.read_csv(csv_filename, engine='pyarrow')
     
     # Auto-detect column names
     column_mapping = detect_columns(csv_data)
@@ -35,111 +76,257 @@ def process_election_data(csv_filename, geojson_filename='polling_divisions.geoj
     total_votes_col = column_mapping['total_votes']
     electors_col = column_mapping['electors']
     
-    print(f"Detected columns:")
-    print(f"  District Number: {district_num_col}")
-    print(f"  District Name: {district_name_col}")
-    print(f"  PD Number: {pd_num_col}")
-    print(f"  PD Name: {pd_name_col}")
-    print(f"  Candidates: {candidate_cols}")
-    print(f"  Rejected: {rejected_col}")
-    print(f"  Total Votes: {total_votes_col}")
-    print(f"  Electors: {electors_col}")
+    vprint(f"Detected columns:")
+    vprint(f"  District Number: {district_num_col}")
+    vprint(f"  District Name: {district_name_col}")
+    vprint(f"  PD Number: {pd_num_col}")
+    vprint(f"  PD Name: {pd_name_col}")
+    vprint(f"  Candidates: {candidate_cols}")
+    vprint(f"  Rejected: {rejected_col}")
+    vprint(f"  Total Votes: {total_votes_col}")
+    vprint(f"  Electors: {electors_col}")
     
     # Get district info from first row
     district_number = csv_data[district_num_col].iloc[0]
     district_name = csv_data[district_name_col].iloc[0]
     
-    print(f"\nProcessing data for: {district_name} (District {district_number})")
-    
-    # Read GeoJSON
-    print(f"Reading GeoJSON from: {geojson_filename}")
-    gdf = gpd.read_file(geojson_filename)
-    
-    print(f"Total features in GeoJSON: {len(gdf)}")
-    print(f"Unique FED_NUM values in GeoJSON: {gdf['FED_NUM'].unique()}")
-    
-    # Filter GeoJSON for target district
-    gdf_district = gdf[gdf['FED_NUM'] == district_number]
-    print(f"Features for District {district_number}: {len(gdf_district)}")
+    vprint(f"\nProcessing data for: {district_name} (District {district_number})")
+    
+    # Read only the target district's boundaries from the per-district cache,
+    # building the cache from the national file on first use
+    cache_dir = ensure_district_cache(geojson_filename)
+    district_cache = os.path.join(cache_dir, f'fed_{district_number}.parquet')
+    if not os.path.exists(district_cache):
+        raise FileNotFoundError(f"District {district_number} not found in '{geojson_filename}' (no {district_cache})")
+    vprint(f"Reading district boundaries from: {district_cache}")
+    gdf_district = gpd.read_parquet(district_cache)
+    vprint(f"Features for District {district_number}: {len(gdf_district)}")
+
+    # Reproject to WGS84 for web mapping now, while only the target district's
+    # geometries are in play (and skip it entirely if the source is already 4326)
+    if gdf_district.crs and gdf_district.crs.to_epsg() != 4326:
+        gdf_district = gdf_district.to_crs('EPSG:4326')
     
     # Clean and process CSV data
     csv_clean = filter_combined_rows(csv_data, candidate_cols[0])
     
-    # Convert numeric columns
+    # Convert numeric columns (the first candidate was already coerced while filtering)
+    # and downcast to int32 — vote counts fit easily and the merge duplicates rows
     numeric_cols = candidate_cols + [rejected_col, total_votes_col, electors_col]
     for col in numeric_cols:
-        csv_clean[col] = pd.to_numeric(csv_clean[col], errors='coerce')
-    
-    # Convert PD number to integer
-    csv_clean['PD_NUM'] = pd.to_numeric(csv_clean[pd_num_col].astype(str).str.strip(), errors='coerce').fillna(0).astype(int)
-    
-    # Get polling division names
-    polling_division_names = csv_clean.groupby('PD_NUM')[pd_name_col].first().reset_index()
-    polling_division_names.columns = ['PD_NUM', 'PD_NAME']
-    
-    # Aggregate by polling division number
-    polling_division_results = csv_clean.groupby('PD_NUM')[numeric_cols].sum().reset_index()
-    
-    # Calculate percentages
-    for candidate in candidate_cols:
-        polling_division_results[f'{candidate}_pct'] = (
-            polling_division_results[candidate] / polling_division_results[total_votes_col] * 100
-        )
-    
-    # Find leading candidate for each polling division
-    polling_division_results['leading_candidate'] = polling_division_results.apply(
-        lambda row: find_leading_candidate(row, candidate_cols), axis=1
-    )
-    polling_division_results['leading_candidate_pct'] = polling_division_results.apply(
-        lambda row: row[f"{row['leading_candidate']}_pct"], axis=1
+        if col != candidate_cols[0]:
+            csv_clean[col] = pd.to_numeric(csv_clean[col], errors='coerce')
+        csv_clean[col] = csv_clean[col].fillna(0).astype(np.int32)
+    
+    # Convert PD number to integer, then to category so groupby reuses the factorization
+    # (only strip whitespace when the column actually holds strings)
+    pd_num_series = csv_clean[pd_num_col]
+    if pd_num_series.dtype == object:
+        pd_num_series = pd_num_series.str.strip()
+    csv_clean['PD_NUM'] = pd.to_numeric(pd_num_series, errors='coerce').fillna(0).astype(np.int32)
+    csv_clean['PD_NUM'] = csv_clean['PD_NUM'].astype('category')
+    
+    # Aggregate by polling division number (vote sums + division name in one pass)
+    agg_map = {col: 'sum' for col in numeric_cols}
+    agg_map[pd_name_col] = 'first'
+    polling_division_results = (
+        csv_clean.groupby('PD_NUM', sort=False, observed=True)
+        .agg(agg_map)
+        .reset_index()
+        .rename(columns={pd_name_col: 'PD_NAME'})
     )
     
-    # Merge with polling division names
-    polling_division_results = polling_division_results.merge(polling_division_names, on='PD_NUM', how='left')
-    
-    print(f"Polling divisions in CSV: {polling_division_results['PD_NUM'].nunique()}")
-    print(f"Polling divisions in filtered GeoJSON: {gdf_district['PD_NUM'].nunique()}")
-    
-    # Merge with GeoJSON
+    # Calculate percentages in one broadcast divide instead of a per-candidate loop
+    vote_vals = polling_division_results[candidate_cols].to_numpy(dtype=np.float64)
+    totals = polling_division_results[total_votes_col].to_numpy(dtype=np.float64)[:, None]
+    pcts = np.divide(vote_vals, totals, out=np.zeros_like(vote_vals), where=totals != 0) * 100.0
+    pct_cols = [f'{candidate}_pct' for candidate in candidate_cols]
+    polling_division_results[pct_cols] = pcts.astype(np.float32)
+
+    # Find leading candidate for each polling division in one fused pass
+    lead_idx, lead_pct = _leading_candidate(vote_vals, totals[:, 0])
+    polling_division_results['leading_candidate'] = np.asarray(candidate_cols, dtype=object)[lead_idx]
+    polling_division_results['leading_candidate_pct'] = lead_pct
+    
+    if verbose:
+        # Diagnostic-only work, so only pay for the nunique passes when asked
+        print(f"Polling divisions in CSV: {polling_division_results['PD_NUM'].nunique()}")
+        print(f"Polling divisions in filtered GeoJSON: {gdf_district['PD_NUM'].nunique()}")
+    
+    # Merge with GeoJSON (int32 keys on both sides: smaller hash, no implicit upcast)
+    gdf_district['PD_NUM'] = pd.to_numeric(gdf_district['PD_NUM'], errors='coerce').fillna(0).astype(np.int32)
+    polling_division_results['PD_NUM'] = polling_division_results['PD_NUM'].astype(np.int32)
     merged_gdf = gdf_district.merge(
-        polling_division_results, 
-        on='PD_NUM', 
-        how='inner'
+        polling_division_results,
+        on='PD_NUM',
+        how='inner',
+        sort=False
     )
     
-    print(f"Successfully merged features: {len(merged_gdf)}")
-    
-    # Convert to WGS84 for web mapping
-    merged_gdf = merged_gdf.to_crs('EPSG:4326')
-    
-    # Save output files
+    vprint(f"Successfully merged features: {len(merged_gdf)}")
+
+    # Save output files (the full write is skippable — serialization dominates runtime)
     results_filename = f"{output_prefix}_election_results.geojson"
     simple_filename = f"{output_prefix}_election_simple.geojson"
-    
-    merged_gdf.to_file(results_filename, driver='GeoJSON')
-    
+
+    if write_full:
+        merged_gdf.to_file(results_filename, driver='GeoJSON', engine='pyogrio')
+
     # Create simplified version
     simple_columns = ['PD_NUM', 'PD_NAME', 'geometry'] + numeric_cols + ['leading_candidate', 'leading_candidate_pct'] + [f'{candidate}_pct' for candidate in candidate_cols]
-    simple_gdf = merged_gdf[simple_columns]
-    simple_gdf.to_file(simple_filename, driver='GeoJSON')
-    
-    print(f"\nProcessing complete!")
-    print(f"Created files:")
-    print(f"- {results_filename} (full data)")
-    print(f"- {simple_filename} (simplified for web)")
-    
-    # Show sample data
-    print(f"\nSample of polling division names:")
-    print(merged_gdf[['PD_NUM', 'PD_NAME']].head(10))
-    
+    simple_gdf = merged_gdf[simple_columns].copy()
+    if simplify_tolerance:
+        # Vertex reduction is what actually shrinks the web file; the column
+        # subset alone leaves the geometry (the bulk of the size) untouched
+        simple_gdf['geometry'] = simple_gdf.geometry.simplify(simplify_tolerance, preserve_topology=True)
+    simple_gdf.to_file(simple_filename, driver='GeoJSON', engine='pyogrio')
+    
+    vprint(f"\nProcessing complete!")
+    vprint(f"Created files:")
+    if write_full:
+        vprint(f"- {results_filename} (full data)")
+    vprint(f"- {simple_filename} (simplified for web)")
+
+    # Show sample data (only slice and format it when it will be shown)
+    if verbose:
+        print(f"\nSample of polling division names:")
+        print(merged_gdf[['PD_NUM', 'PD_NAME']].head(10))
+
     return {
         'district_number': district_number,
         'district_name': district_name,
         'candidates': candidate_cols,
-        'results_file': results_filename,
+        'results_file': results_filename if write_full else None,
         'simple_file': simple_filename
     }
 
+def _leading_candidate_numpy(votes, totals):
+    """Argmax candidate index and its vote share for each row (NumPy fallback)"""
+    lead_idx = votes.argmax(axis=1)
+    lead_votes = votes[np.arange(len(votes)), lead_idx]
+    lead_pct = np.divide(lead_votes, totals, out=np.zeros_like(lead_votes), where=totals != 0) * 100.0
+    return lead_idx, lead_pct
+
+def _leading_candidate_kernel(votes, totals):
+    # Single fused sweep: argmax and pct in one loop, no temporaries.
+    # Pays off over argmax + fancy indexing once ballots get wide.
+    n, k = votes.shape
+    out_idx = np.empty(n, np.int64)
+    out_pct = np.empty(n, np.float64)
+    for i in range(n):
+        best = 0
+        best_votes = votes[i, 0]
+        for j in range(1, k):
+            if votes[i, j] > best_votes:
+                best_votes = votes[i, j]
+                best = j
+        out_idx[i] = best
+        out_pct[i] = best_votes / totals[i] * 100.0 if totals[i] else 0.0
+    return out_idx, out_pct
+
+def process_many(csv_filenames, geojson_filename='polling_divisions.geojson', max_workers=None, simplify_tolerance=1e-5, write_full=False, verbose=False):
+    """Process a batch of election CSVs in parallel, one process per CSV
+
+    Each CSV touches a different district, so the work is embarrassingly
+    parallel. The per-district cache is built once up front so every worker
+    reads only its own district's parquet instead of the national file.
+    Like the CLI, batch runs skip the full-data GeoJSON unless write_full
+    is set, since that write dominates per-district runtime.
+    """
+    _load_heavy_imports()
+    ensure_district_cache(geojson_filename)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(
+            process_election_data,
+            csv_filenames,
+            repeat(geojson_filename),
+            repeat(None),  # output_prefix: derive from each CSV filename
+            repeat(simplify_tolerance),
+            repeat(write_full),
+            repeat(verbose),
+        ))
+
+def _district_cache_dir(geojson_filename):
+    """Cache directory for a boundary file, keyed on its name"""
+    return os.path.splitext(os.path.basename(geojson_filename))[0] + '_cache'
+
+def ensure_district_cache(geojson_filename, cache_dir=None):
+    """Split the national polling division file into one GeoParquet per district
+
+    Reads the full file once and writes {cache_dir}/fed_{FED_NUM}.parquet for
+    each district. The cache records which source it was built from (path and
+    mtime) and is rebuilt when that changes, so a regenerated boundary file or
+    a different geojson_filename never serves stale geometry. The build goes
+    into a temp directory that is renamed into place, so a partial or
+    concurrent first build is never observed as a complete cache.
+    """
+    _load_heavy_imports()
+    if cache_dir is None:
+        cache_dir = _district_cache_dir(geojson_filename)
+
+    parquet_filename = os.path.splitext(geojson_filename)[0] + '.parquet'
+    source = parquet_filename if os.path.exists(parquet_filename) else geojson_filename
+    marker = f"{os.path.abspath(source)}\n{os.path.getmtime(source)}\n"
+    marker_filename = os.path.join(cache_dir, 'source.txt')
+
+    if os.path.isdir(cache_dir):
+        try:
+            with open(marker_filename) as f:
+                if f.read() == marker:
+                    return cache_dir
+        except OSError:
+            pass
+        # Stale source or half-built cache: rebuild from scratch
+        shutil.rmtree(cache_dir)
+
+    print(f"Building district cache from: {source}")
+    if source == parquet_filename:
+        gdf = gpd.read_parquet(parquet_filename)
+    else:
+        gdf = gpd.read_file(geojson_filename, engine='pyogrio')
+
+    # Sort once on FED_NUM so each district is a contiguous binary-search slice
+    gdf = gdf.sort_values('FED_NUM', kind='stable', ignore_index=True)
+    fed_nums = gdf['FED_NUM'].to_numpy()
+
+    build_dir = f'{cache_dir}.tmp-{os.getpid()}'
+    os.makedirs(build_dir)
+    for fed_num in np.unique(fed_nums):
+        first_idx = fed_nums.searchsorted(fed_num)
+        last_idx = fed_nums.searchsorted(fed_num, side='right')
+        gdf.iloc[first_idx:last_idx].to_parquet(os.path.join(build_dir, f'fed_{fed_num}.parquet'), compression='zstd')
+    with open(os.path.join(build_dir, 'source.txt'), 'w') as f:
+        f.write(marker)
+
+    try:
+        os.rename(build_dir, cache_dir)
+    except OSError:
+        # A concurrent build won the race; its cache is equivalent, use it
+        shutil.rmtree(build_dir)
+
+    return cache_dir
+
+def get_district_strtree(district_number, geojson_filename='polling_divisions.geojson', cache_dir=None):
+    """Cached STRtree over a district's polling division geometries
+
+    Builds the spatial index once, pickles it next to the district's parquet,
+    and reloads the pickle on later calls so point-in-division lookups skip
+    the O(N log N) tree build.
+    """
+    _load_heavy_imports()
+    cache_dir = ensure_district_cache(geojson_filename, cache_dir)
+    tree_filename = os.path.join(cache_dir, f'fed_{district_number}_strtree.pkl')
+    if os.path.exists(tree_filename):
+        with open(tree_filename, 'rb') as f:
+            return pickle.load(f)
+
+    from shapely.strtree import STRtree
+    gdf_district = gpd.read_parquet(os.path.join(cache_dir, f'fed_{district_number}.parquet'))
+    tree = STRtree(gdf_district.geometry.values)
+    with open(tree_filename, 'wb') as f:
+        pickle.dump(tree, f)
+    return tree
+
 def detect_columns(df):
     """Auto-detect column names from the CSV structure"""
     columns = df.columns.tolist()
@@ -156,15 +343,15 @@ def detect_columns(df):
     }
     
     detected = {}
-    
-    # Find standard columns
-    for key, patterns in patterns.items():
-        for pattern in patterns:
-            matching_cols = [col for col in columns if pattern in col]
-            if matching_cols:
-                detected[key] = matching_cols[0]
+
+    # Find standard columns in a single pass over the header
+    for col in columns:
+        for key, key_patterns in patterns.items():
+            if key not in detected and any(pattern in col for pattern in key_patterns):
+                detected[key] = col
                 break
-        else:
+    for key in patterns:
+        if key not in detected:
             print(f"Warning: Could not find column for {key}")
     
     # Find candidate columns (columns that are not the standard ones)
@@ -176,24 +363,28 @@ def detect_columns(df):
     return detected
 
 def filter_combined_rows(df, first_candidate_col):
-    """Filter out rows with combined results"""
-    return df[~df[first_candidate_col].astype(str).str.contains('Combined', na=False)]
-
-def find_leading_candidate(row, candidate_cols):
-    """Find the candidate with the most votes in a row"""
-    candidate_votes = {candidate: row[candidate] for candidate in candidate_cols}
-    return max(candidate_votes, key=candidate_votes.get)
+    """Filter out rows with combined results (their vote cells don't parse as numbers)"""
+    first_votes = pd.to_numeric(df[first_candidate_col], errors='coerce')
+    valid = first_votes.notna()
+    df = df[valid].copy()
+    # Keep the coerced values so the caller doesn't have to parse this column again
+    df[first_candidate_col] = first_votes[valid]
+    return df
 
 def main():
     """Main function to handle command line usage"""
-    if len(sys.argv) < 2:
-        print("Usage: python filtergeojson.py <csv_filename> [geojson_filename] [output_prefix]")
+    write_full = '--full' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--full']
+
+    if len(args) < 1:
+        print("Usage: python filtergeojson.py [--full] <csv_filename> [geojson_filename] [output_prefix]")
         print("Example: python filtergeojson.py pollbypoll_bureauparbureau24030.csv polling_divisions.geojson jonquiere")
+        print("Pass --full to also write the full-data GeoJSON (only the simple file is written by default)")
         return
-    
-    csv_filename = sys.argv[1]
-    geojson_filename = sys.argv[2] if len(sys.argv) > 2 else 'polling_divisions.geojson'
-    output_prefix = sys.argv[3] if len(sys.argv) > 3 else None
+
+    csv_filename = args[0]
+    geojson_filename = args[1] if len(args) > 1 else 'polling_divisions.geojson'
+    output_prefix = args[2] if len(args) > 2 else None
     
     if not os.path.exists(csv_filename):
         print(f"Error: CSV file '{csv_filename}' not found")
@@ -204,7 +395,7 @@ def main():
         return
     
     try:
-        result = process_election_data(csv_filename, geojson_filename, output_prefix)
+        result = process_election_data(csv_filename, geojson_filename, output_prefix, write_full=write_full, verbose=True)
         
         # Generate HTML template suggestion
         print(f"\n=== HTML TEMPLATE SUGGESTION ===")
@@ -1,7 +1,9 @@
 import geopandas as gpd
+import pyogrio  # fail fast if the fast I/O engine is missing
 
 # Read the shapefile
-gdf = gpd.read_file('PD_CA_2025_EN.shp')
+gdf = gpd.read_file('PD_CA_2025_EN.shp', engine='pyogrio')
 
-# Convert to GeoJSON
-gdf.to_file('polling_divisions.geojson', driver='GeoJSON')
\ No newline at end of file
+# Write GeoParquet for fast reuse by filtergeojson.py, plus GeoJSON for compatibility
+gdf.to_parquet('polling_divisions.parquet', compression='zstd')
+gdf.to_file('polling_divisions.geojson', driver='GeoJSON', engine='pyogrio')